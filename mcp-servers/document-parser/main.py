@@ -8,16 +8,33 @@ import os
 import re
 import json
 import asyncio
-from typing import Dict, List, Any, Optional
+import functools
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Any, Optional
 from pathlib import Path
 import logging
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 import uvicorn
 from pydantic import BaseModel
 import PyPDF2
+import regex
 import pandas as pd
+import pyarrow as pa
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to PyPDF2 when PDFium bindings are unavailable
+    pdfium = None
+try:
+    import hyperscan
+except ImportError:  # Fall back to the combined regex pattern when Hyperscan is unavailable
+    hyperscan = None
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -41,6 +58,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Parsed results kept per (content hash, file type); extracted text stays on disk, only its hash is cached
+RESULT_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", 64))
+
+# PDFium is not thread-safe, even across separate documents, so every call into it is serialized
+PDFIUM_LOCK = threading.Lock()
+
+# Rows of each table returned in the parse response; total_rows gives the full count
+MAX_TABLE_ROWS = int(os.getenv("MAX_TABLE_ROWS", 1000))
+
+# Extracted text is stored here by content hash and served from /text/{hash}
+EXTRACTED_TEXT_DIR = Path(os.getenv("EXTRACTED_TEXT_DIR", os.path.join(tempfile.gettempdir(), "extracted")))
+
+# Size the text store may reach before the least recently used texts are pruned
+EXTRACTED_TEXT_MAX_BYTES = int(os.getenv("EXTRACTED_TEXT_MAX_BYTES", 512 << 20))
+
+# Metrics emitted per spreadsheet column or row label, so long transaction sheets stay bounded
+MAX_METRICS_PER_LABEL = int(os.getenv("MAX_METRICS_PER_LABEL", 100))
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Unit keywords found in a metric's context, mapped to the unit they imply
+UNIT_KEYWORDS = {
+    'billion': 'billions', 'b': 'billions',
+    'million': 'millions', 'm': 'millions',
+    'thousand': 'thousands', 'k': 'thousands',
+    'percent': 'percentage', '%': 'percentage',
+    'ratio': 'ratio',
+}
+# Scale words win over percentages, which win over ratios
+UNIT_PRIORITY = ('billions', 'millions', 'thousands', 'percentage', 'ratio')
+# Single-letter scales only count after a number, space, "$" or "(", so "P/B" is not billions
+UNIT_PATTERN = re.compile(r'billion|million|thousand|percent|%|\bratio|(?<=[\d\s$(])[bmk]\b', re.IGNORECASE)
+
+# Unit decoration a table header may carry after its label, e.g. "($M)", "(%)", "(in millions)"
+HEADER_UNIT_DECORATION = r'(?:\(\s*(?:in\s+)?[$%]?\s*(?:[bmk]|mm|bn|thousands?|millions?|billions?|percent|usd)?\s*\)|[$%])'
+
+# Non-ASCII characters the metric patterns can match, mapped to ASCII for the Hyperscan scan:
+# "İ", "ſ" and the Kelvin sign fold to i, s and k, and Unicode spaces match \s (but never a
+# literal space, hence the tab)
+HYPERSCAN_ASCII_EQUIVALENTS = {
+    '\u0130': 'i', '\u017f': 's', '\u212a': 'k',
+    **{char: '\t' for char in map(chr, range(0x80, 0x3001)) if char.isspace()},
+}
+
 # Pydantic models
 class FinancialMetric(BaseModel):
     name: str
@@ -54,27 +116,89 @@ class ParseRequest(BaseModel):
     document_id: str
     file_path: str
     file_type: str
+    include_text: bool = False
 
 class ParseResponse(BaseModel):
     document_id: str
     extracted_text: str
+    extracted_text_url: Optional[str] = None
     tables: List[Dict[str, Any]]
     metrics: List[FinancialMetric]
     confidence: float
     success: bool
     error: Optional[str] = None
 
+def extracted_text_path(text_hash: str) -> Path:
+    """Location of stored extracted text in the content-addressed store"""
+    return EXTRACTED_TEXT_DIR / f"{text_hash}.txt"
+
+def touch_extracted_text(text_hash: str) -> bool:
+    """Mark stored text as recently used, returning False if it has been pruned"""
+    try:
+        os.utime(extracted_text_path(text_hash))
+        return True
+    except FileNotFoundError:
+        return False
+
+def prune_extracted_text(keep: Path, keep_size: int) -> None:
+    """Delete the least recently used texts until the store fits in EXTRACTED_TEXT_MAX_BYTES"""
+    files = []
+    for entry in os.scandir(EXTRACTED_TEXT_DIR):
+        # Skip in-flight temporary files and the text that was just stored
+        if not entry.name.endswith('.txt') or entry.name == keep.name:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:  # Pruned by another worker meanwhile
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total = keep_size + sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= EXTRACTED_TEXT_MAX_BYTES:
+            break
+        Path(path).unlink(missing_ok=True)
+        total -= size
+
+def store_extracted_text(text: str) -> str:
+    """Write extracted text to the content-addressed store and return its hash"""
+    data = text.encode('utf-8')
+    text_hash = hashlib.sha256(data).hexdigest()
+    text_path = extracted_text_path(text_hash)
+    
+    if not touch_extracted_text(text_hash):
+        EXTRACTED_TEXT_DIR.mkdir(parents=True, exist_ok=True)
+        # Write under a temporary name first so readers never see a partial file
+        buffer = tempfile.NamedTemporaryFile(dir=EXTRACTED_TEXT_DIR, delete=False)
+        try:
+            with buffer:
+                buffer.write(data)
+            os.replace(buffer.name, text_path)
+        except Exception:
+            os.unlink(buffer.name)
+            raise
+        prune_extracted_text(keep=text_path, keep_size=len(data))
+    
+    return text_hash
+
 class DocumentParser:
     """Main document parsing class"""
     
     def __init__(self):
         self.financial_patterns = self._load_financial_patterns()
+        self._combined_pattern = self._combine_financial_patterns(self.financial_patterns)
+        self._metric_labels = self._compile_metric_labels(self.financial_patterns)
+        # A table row holds whitespace followed by at least three numbers on one line
+        self._table_row_pattern = re.compile(r'[^\S\n]\d[^\n]*\d[^\n]*\d')
+        self._hyperscan_db = self._compile_hyperscan_database(self.financial_patterns)
+        self._hyperscan_local = threading.local()
+        self._result_cache: OrderedDict = OrderedDict()
         
-    def _load_financial_patterns(self) -> Dict[str, str]:
-        """Load regex patterns for financial metric extraction"""
-        return {
-            'revenue': r'(?:revenue|sales|net sales|total revenue)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:million|billion|thousand|M|B|K)?',
-            'net_income': r'(?:net income|net profit|net earnings)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:million|billion|thousand|M|B|K)?',
+    def _load_financial_patterns(self) -> Dict[str, regex.Pattern]:
+        """Load and compile regex patterns for financial metric extraction"""
+        patterns = {
+            'revenue': r'(?:revenue|sales|net sales|total revenue)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:(?:millions?|billions?|thousands?|M|B|K)\b)?',
+            'net_income': r'(?:net income|net profit|net earnings)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:(?:millions?|billions?|thousands?|M|B|K)\b)?',
             'eps': r'(?:earnings per share|eps)[\s:$]*([0-9,]+\.?[0-9]*)',
             'pe_ratio': r'(?:p/e ratio|pe ratio|price.earnings)[\s:]*([0-9,]+\.?[0-9]*)',
             'pb_ratio': r'(?:p/b ratio|pb ratio|price.book)[\s:]*([0-9,]+\.?[0-9]*)',
@@ -85,65 +209,186 @@ class DocumentParser:
             'net_margin': r'(?:net margin|net profit margin)[\s:]*([0-9,]+\.?[0-9]*)%?',
             'roe': r'(?:return on equity|roe)[\s:]*([0-9,]+\.?[0-9]*)%?',
             'roa': r'(?:return on assets|roa)[\s:]*([0-9,]+\.?[0-9]*)%?',
-            'cash_flow': r'(?:cash flow|operating cash flow)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:million|billion|thousand|M|B|K)?',
-            'market_cap': r'(?:market cap|market capitalization)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:million|billion|thousand|M|B|K)?',
+            'cash_flow': r'(?:cash flow|operating cash flow)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:(?:millions?|billions?|thousands?|M|B|K)\b)?',
+            'market_cap': r'(?:market cap|market capitalization)[\s:$]*([0-9,]+\.?[0-9]*)\s*(?:(?:millions?|billions?|thousands?|M|B|K)\b)?',
         }
+        # The regex module scans these alternations faster than re. It stays in V0: V1 adds full
+        # case-folding ("ß" matches "ss"), which the Hyperscan prefilter cannot reproduce
+        return {name: regex.compile(pattern, regex.IGNORECASE) for name, pattern in patterns.items()}
+    
+    def _combine_financial_patterns(self, patterns: Dict[str, regex.Pattern]) -> regex.Pattern:
+        """Fuse metric patterns into one alternation so the text is scanned once"""
+        branches = [f"(?P<{name}>{pattern.pattern})" for name, pattern in patterns.items()]
+        return regex.compile("|".join(branches), regex.IGNORECASE)
+    
+    def _compile_metric_labels(self, patterns: Dict[str, regex.Pattern]) -> Dict[str, re.Pattern]:
+        """Compile the label part of each metric pattern for matching whole table headers"""
+        labels = {}
+        for name, pattern in patterns.items():
+            # Every metric pattern starts with a (?:...) alternation of its labels
+            label = re.match(r'\(\?:[^()]*\)', pattern.pattern).group(0)
+            labels[name] = re.compile(rf'\s*{label}\s*{HEADER_UNIT_DECORATION}?\s*:?\s*', re.IGNORECASE)
+        return labels
+    
+    def _compile_hyperscan_database(self, patterns: Dict[str, regex.Pattern]) -> Optional[Any]:
+        """Compile metric patterns into a Hyperscan database for multi-pattern scanning"""
+        if hyperscan is None:
+            return None
+        
+        database = hyperscan.Database()
+        try:
+            database.compile(
+                expressions=[pattern.pattern.encode() for pattern in patterns.values()],
+                ids=list(range(len(patterns))),
+                elements=len(patterns),
+                flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(patterns)
+            )
+        except hyperscan.error as e:
+            logger.warning(f"Hyperscan compilation failed, using regex for metric extraction: {str(e)}")
+            return None
+        
+        return database
+    
+    def _hyperscan_scratch(self) -> Any:
+        """Return this thread's Hyperscan scratch space (scratch cannot be shared across threads)"""
+        scratch = getattr(self._hyperscan_local, 'scratch', None)
+        if scratch is None:
+            scratch = self._hyperscan_local.scratch = hyperscan.Scratch(self._hyperscan_db)
+        return scratch
     
     async def parse_pdf(self, file_path: str) -> Dict[str, Any]:
         """Extract text and data from PDF files"""
+        return await self._parse_cached(file_path, 'pdf', self._parse_pdf_sync)
+    
+    async def parse_excel(self, file_path: str) -> Dict[str, Any]:
+        """Extract data from Excel files"""
+        return await self._parse_cached(file_path, 'excel', self._parse_excel_sync)
+    
+    async def parse_csv(self, file_path: str) -> Dict[str, Any]:
+        """Extract data from CSV files"""
+        return await self._parse_cached(file_path, 'csv', self._parse_csv_sync)
+    
+    async def _parse_cached(self, file_path: str, file_type: str,
+                            parse_sync: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run a blocking parse in a worker thread, reusing results for identical file contents"""
+        # The cache is only touched from the event loop thread, so it needs no lock
+        digest = await asyncio.to_thread(self._file_digest, file_path)
+        key = (digest, file_type)
+        
+        cached = self._result_cache.get(key)
+        # Stored text may have been pruned from the text store; parse again if so
+        if cached is not None and touch_extracted_text(cached['extracted_text_hash']):
+            self._result_cache.move_to_end(key)
+            return cached
+        
+        # Threads rather than processes: PDFium calls are serialized by PDFIUM_LOCK, and
+        # multi-core PDF throughput comes from running one server worker per core
+        result = await asyncio.to_thread(parse_sync, file_path)
+        
+        # The text lives on disk from here on, so results (and the cache) only keep its hash
+        result['extracted_text_hash'] = await asyncio.to_thread(store_extracted_text, result.pop('extracted_text'))
+        
+        self._result_cache[key] = result
+        if len(self._result_cache) > RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+        
+        return result
+    
+    def _file_digest(self, file_path: str) -> str:
+        """Hash file contents without reading the whole file into memory"""
+        with open(file_path, 'rb') as file:
+            return hashlib.file_digest(file, 'sha256').hexdigest()
+    
+    def _parse_pdf_sync(self, file_path: str) -> Dict[str, Any]:
+        """Blocking PDF parse, run in a worker thread by parse_pdf (PDFium access is locked)"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                
-                # Extract tables (basic implementation)
-                tables = self._extract_tables_from_text(text)
-                
-                # Extract financial metrics
-                metrics = self._extract_financial_metrics(text)
-                
-                return {
-                    'extracted_text': text,
-                    'tables': tables,
-                    'metrics': metrics,
-                    'confidence': 0.8  # Base confidence for PDF extraction
-                }
-                
+            pages = []
+            metrics = []
+            
+            # Scan each page as it is decoded so the regex works on page-sized buffers
+            for page_text in self._iter_pdf_pages(file_path):
+                pages.append(page_text)
+                metrics.extend(self._extract_financial_metrics(page_text))
+            
+            text = "\n".join(pages) + "\n"
+            
+            # Extract tables (basic implementation)
+            tables = self._extract_tables_from_text(text)
+            
+            return {
+                'extracted_text': text,
+                'tables': tables,
+                'metrics': metrics,
+                'confidence': 0.8  # Base confidence for PDF extraction
+            }
+            
         except Exception as e:
             logger.error(f"Error parsing PDF: {str(e)}")
             raise HTTPException(status_code=500, detail=f"PDF parsing failed: {str(e)}")
     
-    async def parse_excel(self, file_path: str) -> Dict[str, Any]:
-        """Extract data from Excel files"""
+    def _iter_pdf_pages(self, file_path: str) -> Iterator[str]:
+        """Yield the text of each PDF page, preferring PDFium over PyPDF2"""
+        if pdfium is not None:
+            try:
+                with PDFIUM_LOCK:
+                    pdf = pdfium.PdfDocument(file_path)
+                    page_count = len(pdf)
+            except pdfium.PdfiumError as e:
+                logger.warning(f"PDFium could not open document, falling back to PyPDF2: {str(e)}")
+            else:
+                try:
+                    for index in range(page_count):
+                        # Hold the lock only while PDFium runs so other threads can scan pages meanwhile.
+                        # Handles are closed explicitly so no finalizer calls PDFium outside the lock.
+                        with PDFIUM_LOCK:
+                            page = pdf[index]
+                            try:
+                                textpage = page.get_textpage()
+                                try:
+                                    # PDFium separates lines with \r\n; match PyPDF2's \n
+                                    page_text = textpage.get_text_range().replace('\r\n', '\n').replace('\r', '\n')
+                                finally:
+                                    textpage.close()
+                            finally:
+                                page.close()
+                        yield page_text
+                finally:
+                    with PDFIUM_LOCK:
+                        pdf.close()
+                return
+        
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page in pdf_reader.pages:
+                yield page.extract_text()
+    
+    def _parse_excel_sync(self, file_path: str) -> Dict[str, Any]:
+        """Blocking Excel parse, run in a worker thread by parse_excel"""
         try:
             # Read all sheets
             excel_data = pd.read_excel(file_path, sheet_name=None)
             
-            text = ""
+            sheet_texts = []
             tables = []
             all_metrics = []
             
             for sheet_name, df in excel_data.items():
-                # Convert DataFrame to text for pattern matching
-                sheet_text = df.to_string()
-                text += f"Sheet: {sheet_name}\n{sheet_text}\n\n"
+                sheet_texts.append(f"Sheet: {sheet_name}\n{df.to_csv(index=False)}\n")
                 
                 # Store table data
                 tables.append({
                     'sheet_name': sheet_name,
-                    'data': df.to_dict('records'),
-                    'columns': df.columns.tolist()
+                    'data': self._table_records(df),
+                    'columns': df.columns.tolist(),
+                    'total_rows': len(df)
                 })
                 
                 # Extract metrics from this sheet
-                sheet_metrics = self._extract_financial_metrics(sheet_text)
+                sheet_metrics = self._extract_dataframe_metrics(df)
                 all_metrics.extend(sheet_metrics)
             
             return {
-                'extracted_text': text,
+                'extracted_text': "".join(sheet_texts),
                 'tables': tables,
                 'metrics': all_metrics,
                 'confidence': 0.9  # Higher confidence for structured data
@@ -153,23 +398,23 @@ class DocumentParser:
             logger.error(f"Error parsing Excel: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Excel parsing failed: {str(e)}")
     
-    async def parse_csv(self, file_path: str) -> Dict[str, Any]:
-        """Extract data from CSV files"""
+    def _parse_csv_sync(self, file_path: str) -> Dict[str, Any]:
+        """Blocking CSV parse, run in a worker thread by parse_csv"""
         try:
-            df = pd.read_csv(file_path)
+            df = self._read_csv(file_path)
             
-            # Convert to text for pattern matching
-            text = df.to_string()
+            text = df.to_csv(index=False)
             
             # Store table data
             tables = [{
                 'sheet_name': 'csv_data',
-                'data': df.to_dict('records'),
-                'columns': df.columns.tolist()
+                'data': self._table_records(df),
+                'columns': df.columns.tolist(),
+                'total_rows': len(df)
             }]
             
             # Extract financial metrics
-            metrics = self._extract_financial_metrics(text)
+            metrics = self._extract_dataframe_metrics(df)
             
             return {
                 'extracted_text': text,
@@ -182,77 +427,212 @@ class DocumentParser:
             logger.error(f"Error parsing CSV: {str(e)}")
             raise HTTPException(status_code=500, detail=f"CSV parsing failed: {str(e)}")
     
+    def _table_records(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Convert the first MAX_TABLE_ROWS rows of a table to JSON-ready records"""
+        head = df.head(MAX_TABLE_ROWS)
+        try:
+            # Arrow builds the row dicts in C++ and turns missing cells into None
+            return pa.Table.from_pandas(head, preserve_index=False).to_pylist()
+        except pa.ArrowException:
+            # Mixed-type object columns (common in Excel) cannot become Arrow arrays
+            return head.astype(object).where(head.notna(), None).to_dict('records')
+    
+    def _read_csv(self, file_path: str) -> pd.DataFrame:
+        """Read a CSV with the pyarrow engine, falling back to the C engine"""
+        try:
+            # Arrow's multithreaded reader and columnar dtypes beat the default C engine
+            df = pd.read_csv(file_path, engine='pyarrow', dtype_backend='pyarrow')
+            if not df.columns.is_unique:
+                reason = "duplicate column names"
+            # Arrow keeps cells that are not valid UTF-8 as raw bytes instead of raising
+            elif any(pa.types.is_binary(dtype.pyarrow_dtype) for dtype in df.dtypes):
+                reason = "non-UTF-8 cells"
+            else:
+                return df
+        except ValueError as e:
+            reason = str(e)
+        
+        # The C engine tolerates ragged rows, renames duplicate headers (Revenue.1)
+        # and raises on undecodable text
+        logger.warning(f"Falling back to the C CSV engine: {reason}")
+        return pd.read_csv(file_path, dtype_backend='pyarrow')
+    
     def _extract_tables_from_text(self, text: str) -> List[Dict[str, Any]]:
         """Extract table-like structures from text (basic implementation)"""
         tables = []
-        
-        # Look for table patterns (simplified)
-        lines = text.split('\n')
         current_table = []
+        previous_end = -1
+        position = 0
         
-        for line in lines:
-            # Check if line looks like a table row (contains multiple numbers/values)
-            if re.search(r'\s+\d+.*\d+.*\d+', line):
-                current_table.append(line.strip())
-            elif current_table:
-                # End of table, save it
-                if len(current_table) > 2:  # At least header + 2 rows
-                    tables.append({
-                        'type': 'extracted_table',
-                        'rows': current_table,
-                        'confidence': 0.6
-                    })
+        # Let the regex skip non-table lines in C instead of testing every line in Python
+        while True:
+            match = self._table_row_pattern.search(text, position)
+            if not match:
+                break
+            
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            line_end = text.find('\n', match.end())
+            if line_end == -1:
+                line_end = len(text)
+            
+            # A gap between matched lines ends the current table
+            if current_table and line_start != previous_end + 1:
+                self._append_extracted_table(tables, current_table)
                 current_table = []
+            
+            current_table.append(text[line_start:line_end].strip())
+            previous_end = line_end
+            position = line_end + 1
+        
+        if current_table:
+            self._append_extracted_table(tables, current_table)
         
         return tables
     
+    def _append_extracted_table(self, tables: List[Dict[str, Any]], rows: List[str]) -> None:
+        """Keep a run of table-like rows if it is long enough to be a table"""
+        if len(rows) > 2:  # At least header + 2 rows
+            tables.append({
+                'type': 'extracted_table',
+                'rows': rows,
+                'confidence': 0.6
+            })
+    
     def _extract_financial_metrics(self, text: str) -> List[FinancialMetric]:
         """Extract financial metrics using regex patterns"""
         metrics = []
-        text_lower = text.lower()
+        groupindex = self._combined_pattern.groupindex
+        
+        for match in self._iter_metric_matches(text):
+            metric_name = match.lastgroup
+            try:
+                # Each branch holds a single value group right after its named group
+                value_str = match.group(groupindex[metric_name] + 1).replace(',', '')
+                value = float(value_str)
+                
+                # Determine unit based on context
+                unit = self._determine_unit(match.group(0))
+                
+                # Fields are already typed by the extractor, so skip pydantic validation
+                metric = FinancialMetric.model_construct(
+                    name=metric_name,
+                    value=value,
+                    unit=unit,
+                    period='current',  # Would need more sophisticated period detection
+                    source='document_extraction',
+                    confidence=0.7
+                )
+                metrics.append(metric)
+                
+            except (ValueError, IndexError):
+                continue
+        
+        return metrics
+    
+    def _extract_dataframe_metrics(self, df: pd.DataFrame) -> List[FinancialMetric]:
+        """Extract financial metrics from labelled columns or rows of a table"""
+        metrics = []
+        
+        metric_columns = set()
+        
+        # Wide layout: one column per metric, e.g. "Revenue", "Net Income"
+        for position, column in enumerate(df.columns):
+            metric_name = self._match_metric_label(str(column))
+            if metric_name:
+                metric_columns.add(position)
+                metrics.extend(self._build_metrics(metric_name, str(column), df.iloc[:, position]))
         
-        for metric_name, pattern in self.financial_patterns.items():
-            matches = re.finditer(pattern, text_lower, re.IGNORECASE)
+        # Long layout: metric labels down the first column, values across each row.
+        # Cells already read through a metric column are skipped so none is counted twice.
+        value_positions = [position for position in range(1, len(df.columns)) if position not in metric_columns]
+        if value_positions and 0 not in metric_columns and not pd.api.types.is_numeric_dtype(df.iloc[:, 0]):
+            labels = df.iloc[:, 0].astype(str)
+            label_names = {label: self._match_metric_label(label) for label in labels.unique()}
+            values = df.iloc[:, value_positions]
             
-            for match in matches:
-                try:
-                    value_str = match.group(1).replace(',', '')
-                    value = float(value_str)
-                    
-                    # Determine unit based on context
-                    unit = self._determine_unit(match.group(0))
-                    
-                    metric = FinancialMetric(
-                        name=metric_name,
-                        value=value,
-                        unit=unit,
-                        period='current',  # Would need more sophisticated period detection
-                        source='document_extraction',
-                        confidence=0.7
-                    )
-                    metrics.append(metric)
-                    
-                except (ValueError, IndexError):
-                    continue
+            for position, label in enumerate(labels):
+                metric_name = label_names[label]
+                if metric_name:
+                    metrics.extend(self._build_metrics(metric_name, label, values.iloc[position]))
         
         return metrics
     
-    def _determine_unit(self, context: str) -> str:
-        """Determine the unit of measurement from context"""
-        context_lower = context.lower()
-        
-        if 'billion' in context_lower or ' b' in context_lower:
-            return 'billions'
-        elif 'million' in context_lower or ' m' in context_lower:
-            return 'millions'
-        elif 'thousand' in context_lower or ' k' in context_lower:
-            return 'thousands'
-        elif '%' in context_lower or 'percent' in context_lower:
-            return 'percentage'
-        elif 'ratio' in context_lower:
-            return 'ratio'
-        else:
-            return 'units'
+    def _match_metric_label(self, label: str) -> Optional[str]:
+        """Return the metric a whole header or row label names, allowing a trailing unit decoration"""
+        for name, label_pattern in self._metric_labels.items():
+            if label_pattern.fullmatch(label):
+                return name
+        
+        return None
+    
+    def _build_metrics(self, metric_name: str, label: str, cells: pd.Series) -> List[FinancialMetric]:
+        """Build one metric per numeric cell (up to MAX_METRICS_PER_LABEL), skipping blanks and text"""
+        percent_cells = False
+        if not pd.api.types.is_numeric_dtype(cells):
+            cells = cells.astype(str)
+            percent_cells = bool(cells.str.contains('%', regex=False).any())
+            cells = cells.str.replace(r'[,$%]', '', regex=True)
+        # Convert the whole column to Python floats at once rather than per cell
+        values = pd.to_numeric(cells, errors='coerce').dropna().head(MAX_METRICS_PER_LABEL).astype('float64').tolist()
+        
+        # A "%" in the cells counts like one after the number in text, with the same unit priority
+        unit = self._determine_unit(f"{label} %" if percent_cells else label)
+        
+        # Fields are already typed by the extractor, so skip pydantic validation
+        return [
+            FinancialMetric.model_construct(
+                name=metric_name,
+                value=value,
+                unit=unit,
+                period='current',  # Would need more sophisticated period detection
+                source='document_extraction',
+                confidence=0.7
+            )
+            for value in values
+        ]
+    
+    def _iter_metric_matches(self, text: str) -> Iterator[regex.Match]:
+        """Yield non-overlapping metric matches in document order"""
+        if self._hyperscan_db is None:
+            yield from self._combined_pattern.finditer(text)
+            return
+        
+        # Hyperscan finds every candidate in one pass but reports each end offset
+        # separately, so collect the leftmost starts and resolve them with regex
+        starts = set()
+        # One byte per character keeps offsets aligned; characters regex would match are
+        # mapped to their ASCII equivalent first so Hyperscan reports the same starts
+        scan_text = text
+        if not text.isascii():
+            # A few targeted replaces are far cheaper than str.translate over the whole page
+            for char, replacement in HYPERSCAN_ASCII_EQUIVALENTS.items():
+                if char in scan_text:
+                    scan_text = scan_text.replace(char, replacement)
+        self._hyperscan_db.scan(
+            scan_text.encode('ascii', 'replace'),
+            match_event_handler=lambda pattern_id, start, end, flags, context: starts.add(start),
+            scratch=self._hyperscan_scratch()
+        )
+        
+        position = 0
+        for start in sorted(starts):
+            if start < position:
+                continue
+            match = self._combined_pattern.match(text, start)
+            if match:
+                position = match.end()
+                yield match
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _determine_unit(context: str) -> str:
+        """Determine the unit of measurement from context (memoized, contexts repeat)"""
+        units = {UNIT_KEYWORDS[token.lower()] for token in UNIT_PATTERN.findall(context)}
+        
+        for unit in UNIT_PRIORITY:
+            if unit in units:
+                return unit
+        return 'units'
 
 # Initialize parser
 parser = DocumentParser()
@@ -273,18 +653,26 @@ async def parse_document(request: ParseRequest):
             raise HTTPException(status_code=404, detail="File not found")
         
         # Parse based on file type
-        if request.file_type.lower() == 'pdf':
+        file_type = request.file_type.lower()
+        if file_type == 'pdf':
             result = await parser.parse_pdf(request.file_path)
-        elif request.file_type.lower() in ['excel', 'xlsx', 'xls']:
+        elif file_type in ['excel', 'xlsx', 'xls']:
             result = await parser.parse_excel(request.file_path)
-        elif request.file_type.lower() == 'csv':
+        elif file_type == 'csv':
             result = await parser.parse_csv(request.file_path)
         else:
             raise HTTPException(status_code=400, detail=f"Unsupported file type: {request.file_type}")
         
+        # Large documents would bloat the JSON, so the text is returned by reference
+        text_hash = result['extracted_text_hash']
+        extracted_text = ""
+        if request.include_text:
+            extracted_text = await asyncio.to_thread(extracted_text_path(text_hash).read_text, encoding='utf-8')
+        
         return ParseResponse(
             document_id=request.document_id,
-            extracted_text=result['extracted_text'],
+            extracted_text=extracted_text,
+            extracted_text_url=f"/text/{text_hash}",
             tables=result['tables'],
             metrics=result['metrics'],
             confidence=result['confidence'],
@@ -305,17 +693,21 @@ async def parse_document(request: ParseRequest):
             error=str(e)
         )
 
+@app.get("/text/{text_hash}")
+async def get_extracted_text(text_hash: str):
+    """Return the extracted text of a parsed document"""
+    text_path = extracted_text_path(text_hash)
+    
+    if not re.fullmatch(r'[0-9a-f]{64}', text_hash) or not text_path.exists():
+        raise HTTPException(status_code=404, detail="Extracted text not found")
+    
+    return FileResponse(text_path, media_type="text/plain")
+
 @app.post("/upload-and-parse")
 async def upload_and_parse(file: UploadFile = File(...)):
     """Upload and immediately parse a document"""
+    temp_path = None
     try:
-        # Save uploaded file temporarily
-        temp_path = f"/tmp/{file.filename}"
-        
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
         # Determine file type
         file_extension = Path(file.filename).suffix.lower()
         file_type_map = {
@@ -330,6 +722,11 @@ async def upload_and_parse(file: UploadFile = File(...)):
         if file_type == 'unknown':
             raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_extension}")
         
+        # Save uploaded file under a unique name so concurrent uploads never collide
+        with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as buffer:
+            temp_path = buffer.name
+            await asyncio.to_thread(shutil.copyfileobj, file.file, buffer, UPLOAD_CHUNK_SIZE)
+        
         # Parse the document
         request = ParseRequest(
             document_id=f"upload_{file.filename}",
@@ -337,25 +734,29 @@ async def upload_and_parse(file: UploadFile = File(...)):
             file_type=file_type
         )
         
-        result = await parse_document(request)
-        
-        # Clean up temp file
-        os.unlink(temp_path)
-        
-        return result
+        return await parse_document(request)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in upload and parse: {str(e)}")
-        # Clean up temp file if it exists
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.unlink(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Clean up temp file
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8001))
+    reload = os.getenv("NODE_ENV") == "development"
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=port,
-        reload=True if os.getenv("NODE_ENV") == "development" else False
+        # uvloop and httptools ship with uvicorn[standard]
+        loop="uvloop",
+        http="httptools",
+        # One worker process per core so PDF parses run in parallel; reload needs a single process
+        workers=1 if reload else int(os.getenv("WORKERS", os.cpu_count() or 1)),
+        reload=reload
     )
\ No newline at end of file